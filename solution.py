@@ -1,13 +1,31 @@
+import io
 import os
+import re
 import sys
 import json
+import time
+import asyncio
+import hashlib
+import sqlite3
 import traceback
 import argparse
-from collections import deque, defaultdict
-from datetime import timedelta
+from collections import defaultdict
 
+import numpy as np
+import openai
+import orjson
 import pandas as pd
-from openai import OpenAI
+from aiolimiter import AsyncLimiter
+from joblib import Parallel, delayed
+from numba import njit, types
+from numba.typed import Dict
+from openai import OpenAI, AsyncOpenAI
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_exponential_jitter,
+)
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
@@ -15,13 +33,44 @@ if not OPENAI_API_KEY:
     print("Error: Set OPENAI_API_KEY environment variable.", file=sys.stderr)
 
 client = OpenAI(api_key=OPENAI_API_KEY)
+aclient = AsyncOpenAI(api_key=OPENAI_API_KEY)
+
+# Maximum number of in-flight LLM requests
+MAX_CONCURRENT_REQUESTS = 20
+
+# Token-bucket budget for live API calls
+REQUESTS_PER_MINUTE = 300
+
+# Number of items classified per LLM request
+PROMPT_BATCH_SIZE = 32
+
+# Model and chunk size for title embeddings
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_BATCH_SIZE = 256
+
+# Minimum cosine similarity for a semantic cache hit
+SEMANTIC_CACHE_THRESHOLD = 0.95
+
+# Titles that are trivially noise; matching pairs skip the LLM entirely
+NOISE_RE = re.compile(r"heartbeat|healthcheck|cron|backup complete|keepalive", re.I)
+
+# LLM response cache (one SQLite file, namespaced per pass)
+LLM_CACHE_DB = "cache/llm_cache.sqlite"
+CHANGE_NOISE_NS = "change_noise"
+INCIDENT_NOISE_NS = "incident_noise"
+CAUSALITY_NS = "causality"
+
+# Legacy JSON caches, imported into SQLite on first open
+LEGACY_CACHE_FILES = {
+    CHANGE_NOISE_NS: "cache/change_noise_cache.json",
+    INCIDENT_NOISE_NS: "cache/incident_noise_cache.json",
+    CAUSALITY_NS: "cache/causality_cache.json",
+}
 
-# Caching filenames
-CHANGE_NOISE_CACHE_FILE = "cache/change_noise_cache.json"
-INCIDENT_NOISE_CACHE_FILE = "cache/incident_noise_cache.json"
-CAUSALITY_CACHE_FILE = "cache/causality_cache.json"
 COUNT_PAIRS_CACHE_FILE = "cache/raw_count_pairs_cache.json"
 
+_db = None
+
 
 def parse_args():
     """Parse command line arguments."""
@@ -33,112 +82,571 @@ def parse_args():
     parser.add_argument("--output", required=True)
     parser.add_argument("--window-minutes", type=int, default=60)
     parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument(
+        "--use-batch-api",
+        action="store_true",
+        help="Route cache misses through the OpenAI Batch API (cheaper, slower)",
+    )
+    parser.add_argument(
+        "--use-processes",
+        action="store_true",
+        help="Correlate groups in worker processes instead of threads",
+    )
     return parser.parse_args()
 
 
-def load_cache(path):
-    """Load cache from a JSON file."""
-    try:
-        if os.path.exists(path):
-            with open(path, "r") as f:
-                return json.load(f)
-        return {}
-    except json.JSONDecodeError:
-        print(f"Error loading cache from {path}. Cache will be reset.", file=sys.stderr)
+def get_db():
+    """Open the SQLite cache, creating and migrating it if needed."""
+    global _db
+    if _db is None:
+        os.makedirs(os.path.dirname(LLM_CACHE_DB), exist_ok=True)
+        _db = sqlite3.connect(LLM_CACHE_DB)
+        _db.execute(
+            "CREATE TABLE IF NOT EXISTS kv (ns TEXT, k TEXT, v TEXT, PRIMARY KEY (ns, k))"
+        )
+        _db.execute("CREATE TABLE IF NOT EXISTS emb (k TEXT PRIMARY KEY, v BLOB)")
+        # One-time import of the legacy per-pass JSON caches.
+        for ns, path in LEGACY_CACHE_FILES.items():
+            row = _db.execute("SELECT 1 FROM kv WHERE ns = ? LIMIT 1", (ns,)).fetchone()
+            if row is None and os.path.exists(path):
+                try:
+                    with open(path, "r") as f:
+                        legacy = json.load(f)
+                    _db.executemany(
+                        "INSERT OR REPLACE INTO kv VALUES (?, ?, ?)",
+                        [(ns, k, v) for k, v in legacy.items()],
+                    )
+                except json.JSONDecodeError:
+                    print(f"Skipping corrupt legacy cache {path}", file=sys.stderr)
+        _db.commit()
+    return _db
+
+
+class CacheView:
+    """
+    Dict-like view over one namespace of the SQLite LLM cache.
+
+    Writes go straight to SQLite and are committed every COMMIT_EVERY
+    items, so a crash mid-run loses at most one small batch instead of
+    the whole cache file.
+    """
+
+    COMMIT_EVERY = 50
+
+    def __init__(self, ns):
+        self.ns = ns
+        self._db = get_db()
+        self._pending = 0
+
+    def __contains__(self, key):
+        row = self._db.execute(
+            "SELECT 1 FROM kv WHERE ns = ? AND k = ?", (self.ns, key)
+        ).fetchone()
+        return row is not None
+
+    def __getitem__(self, key):
+        row = self._db.execute(
+            "SELECT v FROM kv WHERE ns = ? AND k = ?", (self.ns, key)
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return row[0]
+
+    def __setitem__(self, key, value):
+        self._db.execute(
+            "INSERT OR REPLACE INTO kv VALUES (?, ?, ?)", (self.ns, key, value)
+        )
+        self._pending += 1
+        if self._pending >= self.COMMIT_EVERY:
+            self.flush()
+
+    def flush(self):
+        self._db.commit()
+        self._pending = 0
+
+    def values(self):
+        # NULL labels (migrated API failures) carry nothing reusable.
+        rows = self._db.execute(
+            "SELECT v FROM kv WHERE ns = ? AND v IS NOT NULL", (self.ns,)
+        )
+        return [row[0] for row in rows]
+
+
+def item_repr(item):
+    """Human-readable form of an item (string or pair)."""
+    if not isinstance(item, str):
+        return f"{item[0]} ||| {item[1]}"
+    return item
+
+
+def template_signature(prompt_template, item_template):
+    """Combine the instruction and item templates for cache keying."""
+    return f"{prompt_template}\0{item_template}"
+
+
+def generation(template_sig, model):
+    """Short digest identifying one (model, templates) generation."""
+    raw = f"{model}\0{template_sig}"
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def cache_record(item, label, gen):
+    """Serialize one cache entry, tagged with its generation."""
+    return json.dumps(
+        {"item": item_repr(item), "label": label, "gen": gen}, ensure_ascii=False
+    )
+
+
+def key_for(item, template_sig, model):
+    """
+    Stable cache key over (model, prompt templates, item).
+
+    Hashing the templates and model into the key means a prompt tweak or
+    model switch produces cache misses instead of silently returning
+    stale labels, and the three namespaces can never collide on a title.
+    """
+    raw = f"{model}\0{template_sig}\0{item_repr(item)}"
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def get_embeddings(titles):
+    """
+    Embed titles, caching the vectors as float32 blobs in SQLite.
+
+    Args:
+        titles: Ordered list of title strings.
+
+    Returns:
+        (len(titles), dim) float32 array of L2-normalized embeddings.
+    """
+    db = get_db()
+    vectors = {}
+    misses = []
+    for title in titles:
+        row = db.execute(
+            "SELECT v FROM emb WHERE k = ?", (f"{EMBEDDING_MODEL}\0{title}",)
+        ).fetchone()
+        if row is not None:
+            vectors[title] = np.frombuffer(row[0], dtype=np.float32)
+        else:
+            misses.append(title)
+
+    for i in range(0, len(misses), EMBEDDING_BATCH_SIZE):
+        chunk = misses[i : i + EMBEDDING_BATCH_SIZE]
+        response = client.embeddings.create(model=EMBEDDING_MODEL, input=chunk)
+        for title, datum in zip(chunk, response.data):
+            vec = np.asarray(datum.embedding, dtype=np.float32)
+            vectors[title] = vec
+            db.execute(
+                "INSERT OR REPLACE INTO emb VALUES (?, ?)",
+                (f"{EMBEDDING_MODEL}\0{title}", vec.tobytes()),
+            )
+    db.commit()
+
+    mat = np.stack([vectors[title] for title in titles])
+    return mat / np.linalg.norm(mat, axis=1, keepdims=True)
+
+
+def semantic_lookup(cache, misses, gen):
+    """
+    Resolve cache misses against semantically similar cached items.
+
+    Titles like "Deploy api-server v1.23.4" and "... v1.23.5" classify
+    identically, so a miss whose embedding is within
+    SEMANTIC_CACHE_THRESHOLD cosine similarity of an already-labeled
+    item reuses that label without a chat call. Embeddings are ~10x
+    cheaper than the classification calls they replace.
+
+    Only entries written under the current (model, templates)
+    generation are consulted; without that filter, an item cached under
+    an old prompt would match itself at cosine 1.0 and silently revive
+    the stale label a template edit was meant to invalidate.
+
+    Args:
+        cache: CacheView for the current namespace.
+        misses: Items that missed the exact-key cache.
+        gen: Generation digest for the current pass.
+
+    Returns:
+        Dictionary mapping resolved items to reused labels.
+    """
+    past = {}
+    for value in cache.values():
+        try:
+            record = json.loads(value)
+        except (TypeError, ValueError):
+            # Legacy raw-key entries hold bare label strings; skip them.
+            continue
+        if (
+            isinstance(record, dict)
+            and record.get("gen") == gen
+            and record.get("label") is not None
+        ):
+            past[record["item"]] = record["label"]
+    if not past or not misses:
         return {}
 
+    past_items = sorted(past)
+    miss_reprs = [item_repr(item) for item in misses]
+    emb = get_embeddings(past_items + miss_reprs)
+    sims = emb[len(past_items) :] @ emb[: len(past_items)].T
+
+    hits = {}
+    best = np.argmax(sims, axis=1)
+    for i, item in enumerate(misses):
+        if sims[i, best[i]] > SEMANTIC_CACHE_THRESHOLD:
+            hits[item] = past[past_items[best[i]]]
+    return hits
+
+
+def cluster_titles(titles):
+    """
+    Group titles into families and pick a representative per family.
 
-def save_cache(cache, path):
-    """Save cache to a JSON file."""
+    Runs a small k-means (k ~ sqrt(n)) over cached embeddings, then
+    takes the medoid of each cluster as its representative.
+
+    Args:
+        titles: List of title strings.
+
+    Returns:
+        Dictionary mapping each title to its family representative.
+    """
+    titles = sorted(titles)
+    if len(titles) <= 2:
+        return {title: title for title in titles}
+
+    emb = get_embeddings(titles)
+    k = max(1, int(np.ceil(np.sqrt(len(titles)))))
+
+    rng = np.random.default_rng(0)
+    centroids = emb[rng.choice(len(titles), size=k, replace=False)]
+    assign = np.zeros(len(titles), dtype=np.int64)
+    for _ in range(20):
+        new_assign = np.argmax(emb @ centroids.T, axis=1)
+        if np.array_equal(new_assign, assign):
+            break
+        assign = new_assign
+        for j in range(k):
+            members = emb[assign == j]
+            if len(members):
+                centroid = members.mean(axis=0)
+                centroids[j] = centroid / np.linalg.norm(centroid)
+
+    family_of = {}
+    for j in range(k):
+        idxs = np.where(assign == j)[0]
+        if not len(idxs):
+            continue
+        medoid = idxs[np.argmax(emb[idxs] @ centroids[j])]
+        for i in idxs:
+            family_of[titles[i]] = titles[medoid]
+    return family_of
+
+
+def labels_schema(label_enum):
+    """JSON schema forcing a reply of one enum label per item."""
+    return {
+        "name": "labels",
+        "schema": {
+            "type": "object",
+            "properties": {
+                "labels": {
+                    "type": "array",
+                    "items": {"type": "string", "enum": list(label_enum)},
+                }
+            },
+            "required": ["labels"],
+            "additionalProperties": False,
+        },
+        "strict": True,
+    }
+
+
+def render_items(item_template, batch):
+    """Render a numbered list of items for the user message."""
+    return "\n".join(
+        f"{i}. {item_template.format(item=item)}" for i, item in enumerate(batch)
+    )
+
+
+def parse_labels(text, n):
+    """
+    Parse n labels out of a schema-constrained model reply.
+
+    Returns a list of n labels, or n Nones if the reply is unusable.
+    """
     try:
-        with open(path, "w") as f:
-            json.dump(cache, f, indent=2)
-    except Exception as e:
-        print(f"Error saving cache to {path}: {e}", file=sys.stderr)
-        traceback.print_exc(file=sys.stderr)
+        data = json.loads(text)
+        if isinstance(data, dict):
+            data = data.get("labels")
+        if isinstance(data, list) and len(data) == n:
+            return data
+    except ValueError:
+        pass
+    print(f"Unparseable label array in reply: {text!r}", file=sys.stderr)
+    return [None] * n
+
+
+def submit_batch(items, prompt_template, item_template, label_enum, model):
+    """
+    Classify items through the OpenAI Batch API.
 
+    Args:
+        items: List of items to classify.
+        prompt_template: Static instruction for this pass.
+        item_template: Template for one item line.
+        label_enum: Allowed label values for this pass.
+        model: Model name.
 
-def classify_with_llm(items, prompt_template, cache_file, model):
+    Returns:
+        Dictionary mapping cache keys to labels.
+
+    1. Serialize one chat-completions request per item to JSONL.
+    2. Upload the JSONL as a batch input file.
+    3. Create the batch with a 24h completion window.
+    4. Poll the batch status with exponential backoff.
+    5. Download and parse the output file into key -> label.
+    """
+    template_sig = template_signature(prompt_template, item_template)
+    lines = []
+    for item in items:
+        lines.append(
+            json.dumps(
+                {
+                    "custom_id": key_for(item, template_sig, model),
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": model,
+                        "messages": [
+                            {"role": "system", "content": prompt_template},
+                            {
+                                "role": "user",
+                                "content": render_items(item_template, [item]),
+                            },
+                        ],
+                        "temperature": 0,
+                        "response_format": {
+                            "type": "json_schema",
+                            "json_schema": labels_schema(label_enum),
+                        },
+                    },
+                },
+                ensure_ascii=False,
+            )
+        )
+
+    batch_file = client.files.create(
+        file=io.BytesIO("\n".join(lines).encode("utf-8")),
+        purpose="batch",
+    )
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+
+    delay = 5
+    while True:
+        batch = client.batches.retrieve(batch.id)
+        if batch.status in ("completed", "failed", "expired", "cancelled"):
+            break
+        time.sleep(delay)
+        delay = min(delay * 2, 300)
+
+    if batch.status != "completed":
+        print(f"Batch {batch.id} ended with status {batch.status}", file=sys.stderr)
+        return {}
+
+    labels = {}
+    output = client.files.content(batch.output_file_id).text
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        body = record.get("response", {}).get("body", {})
+        choices = body.get("choices", [])
+        if choices:
+            labels[record["custom_id"]] = parse_labels(
+                choices[0]["message"]["content"], 1
+            )[0]
+    return labels
+
+
+async def classify_with_llm_async(
+    items, prompt_template, item_template, label_enum, cache_ns, model, use_batch=False
+):
     """
-    Classify items using LLM and cache results.
+    Classify items using LLM concurrently and cache results.
 
     Args:
         items: List of items to classify.
-        prompt_template: Template for the prompt.
-        cache_file: Path to the cache file.
+        prompt_template: Static instruction for this pass.
+        item_template: Template for one item line.
+        label_enum: Allowed label values for this pass.
+        cache_ns: Cache namespace for this classification pass.
         model: Model name.
+        use_batch: Route cache misses through the Batch API.
 
     Returns:
         Dictionary of classified items.
 
-    1. Load cache from the specified file.
-    2. Initialize an empty dictionary for results.
-    3. Iterate over each item in the input list.
-    4. Create a unique key for each item.
-    5. Check if the key is already in the cache.
-    6. If found, retrieve the label from the cache.
-    7. If not found, create a prompt using the template.
-    8. Call the LLM API to get the label.
-    9. Handle any exceptions during the API call.
-    10. Save the label to the cache.
-    11. Store the label in the results dictionary.
-    12. Save the updated cache to the file.
-    13. Return the results dictionary.
-    14. Handle any unexpected errors and print the stack trace.
+    1. Open a view over the cache namespace.
+    2. Resolve cached items directly into the results dictionary.
+    3. Collect the cache misses into a list.
+    4. Resolve near-duplicate misses from the semantic cache layer.
+    5. If use_batch is set, classify all misses via submit_batch.
+    6. Otherwise chunk misses into prompt batches of PROMPT_BATCH_SIZE.
+    7. Dispatch one API call per chunk, bounded by a semaphore.
+    8. Await all calls together with asyncio.gather.
+    9. Parse each reply into one label per item in the chunk.
+    10. Save each label to the cache and the results dictionary.
+    11. Flush any pending cache writes.
+    12. Return the results dictionary.
+    13. Handle any unexpected errors and print the stack trace.
     """
     try:
-        cache = load_cache(cache_file)
+        cache = CacheView(cache_ns)
+        template_sig = template_signature(prompt_template, item_template)
+        gen = generation(template_sig, model)
         results = {}
 
+        misses = []
         for item in items:
-            if not isinstance(item, str):
-                key = f"{item[0]} ||| {item[1]}"
-            else:
-                key = item
+            key = key_for(item, template_sig, model)
             if key in cache:
-                results[item] = cache[key]
-                continue
-
-            prompt = prompt_template.format(item=item)
-
-            try:
-                response = client.responses.create(
+                results[item] = json.loads(cache[key])["label"]
+            else:
+                misses.append(item)
+
+        # Second chance: reuse labels of near-duplicate cached items.
+        if misses:
+            semantic_hits = semantic_lookup(cache, misses, gen)
+            remaining = []
+            for item in misses:
+                if item in semantic_hits:
+                    label = semantic_hits[item]
+                    cache[key_for(item, template_sig, model)] = cache_record(
+                        item, label, gen
+                    )
+                    results[item] = label
+                else:
+                    remaining.append(item)
+            misses = remaining
+
+        if use_batch and misses:
+            batch_labels = submit_batch(
+                misses, prompt_template, item_template, label_enum, model
+            )
+            for item in misses:
+                key = key_for(item, template_sig, model)
+                label = batch_labels.get(key)
+                if label is not None:
+                    cache[key] = cache_record(item, label, gen)
+                results[item] = label
+            cache.flush()
+            return results
+
+        chunks = [
+            misses[i : i + PROMPT_BATCH_SIZE]
+            for i in range(0, len(misses), PROMPT_BATCH_SIZE)
+        ]
+        sem = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        limiter = AsyncLimiter(REQUESTS_PER_MINUTE, 60)
+
+        @retry(
+            retry=retry_if_exception_type(
+                (openai.RateLimitError, openai.APIConnectionError)
+            ),
+            wait=wait_exponential_jitter(initial=1, max=30),
+            stop=stop_after_attempt(6),
+        )
+        async def call_api(listing):
+            # The instruction rides in the system message, identical
+            # across calls, so server-side prompt caching discounts it.
+            async with limiter, sem:
+                return await aclient.responses.create(
                     model=model,
-                    input=[{"role": "user", "content": prompt}],
+                    input=[
+                        {"role": "system", "content": prompt_template},
+                        {"role": "user", "content": listing},
+                    ],
                     temperature=0,
+                    text={
+                        "format": {
+                            "type": "json_schema",
+                            **labels_schema(label_enum),
+                        }
+                    },
                 )
-                label = response.output_text
-            except Exception as e:
-                print(f"Error classifying '{item}': {e}", file=sys.stderr)
-                traceback.print_exc(file=sys.stderr)
-                label = None
 
-            cache[key] = label
-            results[item] = label
+        async def one(chunk):
+            response = await call_api(render_items(item_template, chunk))
+            return parse_labels(response.output_text, len(chunk))
+
+        replies = await asyncio.gather(
+            *(one(chunk) for chunk in chunks), return_exceptions=True
+        )
 
-        save_cache(cache, cache_file)
+        for chunk, labels in zip(chunks, replies):
+            if isinstance(labels, BaseException):
+                print(f"Error classifying chunk of {len(chunk)}: {labels}", file=sys.stderr)
+                labels = [None] * len(chunk)
+            for item, label in zip(chunk, labels):
+                # Failures stay uncached so the next run retries them.
+                if label is not None:
+                    cache[key_for(item, template_sig, model)] = cache_record(
+                        item, label, gen
+                    )
+                results[item] = label
+
+        cache.flush()
         return results
 
     except Exception as e:
-        print(f"Unexpected error in classify_with_llm: {e}", file=sys.stderr)
+        print(f"Unexpected error in classify_with_llm_async: {e}", file=sys.stderr)
         traceback.print_exc(file=sys.stderr)
         sys.exit(1)
 
 
+def classify_with_llm(
+    items, prompt_template, item_template, label_enum, cache_ns, model, use_batch=False
+):
+    """Synchronous wrapper around classify_with_llm_async."""
+    return asyncio.run(
+        classify_with_llm_async(
+            items, prompt_template, item_template, label_enum, cache_ns, model, use_batch
+        )
+    )
+
+
 def load_and_prepare(change_path, incident_path):
     """Load and prepare data from CSV files."""
     try:
-        changes = pd.read_csv(change_path)
+        # The pyarrow engine parses in parallel threads, and usecols
+        # pushdown skips materializing unused columns entirely.
+        changes = pd.read_csv(
+            change_path,
+            engine="pyarrow",
+            usecols=["account_id", "service_id", "title", "timestamp"],
+        )
         changes["timestamp"] = pd.to_datetime(
             changes["timestamp"], format="%Y-%m-%d %I:%M:%S %p"
         )
         changes = changes[["account_id", "service_id", "title", "timestamp"]]
+        changes["title"] = changes["title"].astype("category")
 
-        incidents = pd.read_csv(incident_path)
+        incidents = pd.read_csv(
+            incident_path,
+            engine="pyarrow",
+            usecols=["account_id", "service_id", "title", "triggered_at"],
+        )
         incidents["timestamp"] = pd.to_datetime(
             incidents["triggered_at"], format="%Y-%m-%d %I:%M:%S %p"
         )
         incidents = incidents[["account_id", "service_id", "title", "timestamp"]]
+        incidents["title"] = incidents["title"].astype("category")
 
         return changes, incidents
     except Exception as e:
@@ -147,7 +655,57 @@ def load_and_prepare(change_path, incident_path):
         sys.exit(1)
 
 
-def raw_correlate(changes, incidents, window_minutes):
+@njit(cache=True, nogil=True)
+def _sweep(chg_ts, chg_codes, inc_ts, inc_codes, window_ns, n_chg_titles):
+    """
+    Two-pointer sliding-window sweep over one group's sorted arrays.
+
+    Counts, per (incident title code, change title code) pair, how many
+    incidents had that change title inside their window. Pairs are
+    packed as int64 keys (inc_code * n_chg_titles + chg_code) and
+    returned as parallel (keys, counts) arrays.
+
+    Unlike the original deque implementation, which rebuilt a set of
+    every title in the window for every incident (O(window) per
+    incident), the stamp array dedups each title in O(1) amortized as
+    the window advances.
+    """
+    pair_counts = Dict.empty(key_type=types.int64, value_type=types.int64)
+    # Per-title "last seen in incident" stamp, so dedup within a
+    # window needs no per-incident allocation.
+    seen = np.zeros(n_chg_titles, dtype=np.int64)
+
+    lo = 0
+    hi = 0
+    n = chg_ts.shape[0]
+    for i in range(inc_ts.shape[0]):
+        its = inc_ts[i]
+        cutoff = its - window_ns
+        while hi < n and chg_ts[hi] <= its:
+            hi += 1
+        while lo < hi and chg_ts[lo] < cutoff:
+            lo += 1
+
+        stamp = i + 1
+        base = inc_codes[i] * n_chg_titles
+        for j in range(lo, hi):
+            c = chg_codes[j]
+            if seen[c] != stamp:
+                seen[c] = stamp
+                key = base + c
+                pair_counts[key] = pair_counts.get(key, 0) + 1
+
+    keys = np.empty(len(pair_counts), dtype=np.int64)
+    counts = np.empty(len(pair_counts), dtype=np.int64)
+    pos = 0
+    for key, count in pair_counts.items():
+        keys[pos] = key
+        counts[pos] = count
+        pos += 1
+    return keys, counts
+
+
+def raw_correlate(changes, incidents, window_minutes, use_processes=False):
     """ "
     Correlate changes and incidents based on a time window."
 
@@ -155,6 +713,7 @@ def raw_correlate(changes, incidents, window_minutes):
         changes: DataFrame of changes.
         incidents: DataFrame of incidents.
         window_minutes: Time window in minutes.
+        use_processes: Shard groups across worker processes.
 
     Returns:
         Dictionary of correlated pairs and their counts.
@@ -168,33 +727,89 @@ def raw_correlate(changes, incidents, window_minutes):
 
     """
     try:
-        window = timedelta(minutes=window_minutes)
+        window_ns = window_minutes * 60 * 1_000_000_000
         results = defaultdict(int)
 
-        grp_chg = changes.groupby(["account_id", "service_id"])
-        grp_inc = incidents.groupby(["account_id", "service_id"])
+        # No rows on either side means no pairs, and the composite-key
+        # arithmetic below would choke on an empty max().
+        if changes.empty or incidents.empty:
+            return results
+
+        # Global string -> int code mapping, built once so every group
+        # shares the same code space inside the JIT kernel.
+        chg_cat = pd.Categorical(changes["title"])
+        inc_cat = pd.Categorical(incidents["title"])
+        n_chg_titles = len(chg_cat.categories)
+
+        changes = changes.assign(title_code=chg_cat.codes.astype(np.int64))
+        incidents = incidents.assign(title_code=inc_cat.codes.astype(np.int64))
+
+        # Sort each frame once by (account, service, timestamp); every
+        # group is then a contiguous, already-sorted slice, so the loop
+        # below needs no get_group and no per-group re-sort.
+        sort_cols = ["account_id", "service_id", "timestamp"]
+        changes = changes.sort_values(sort_cols).reset_index(drop=True)
+        incidents = incidents.sort_values(sort_cols).reset_index(drop=True)
+
+        K = (
+            int(
+                max(
+                    changes["service_id"].max(),
+                    incidents["service_id"].max(),
+                )
+            )
+            + 1
+        )
+        chg_grp_key = (
+            changes["account_id"].to_numpy(np.int64) * K
+            + changes["service_id"].to_numpy(np.int64)
+        )
+        inc_grp_key = (
+            incidents["account_id"].to_numpy(np.int64) * K
+            + incidents["service_id"].to_numpy(np.int64)
+        )
 
-        common = set(grp_chg.groups) & set(grp_inc.groups)
-        for key in common:
-            chg = grp_chg.get_group(key).sort_values("timestamp")
-            inc = grp_inc.get_group(key).sort_values("timestamp")
+        chg_ts_all = changes["timestamp"].values.astype("datetime64[ns]").view("i8")
+        chg_codes_all = changes["title_code"].to_numpy(dtype=np.int64)
+        inc_ts_all = incidents["timestamp"].values.astype("datetime64[ns]").view("i8")
+        inc_codes_all = incidents["title_code"].to_numpy(dtype=np.int64)
 
-            dq = deque()
-            idx = 0
-            n = len(chg)
+        chg_keys, chg_starts = np.unique(chg_grp_key, return_index=True)
+        chg_ends = np.r_[chg_starts[1:], len(chg_grp_key)]
+        inc_keys, inc_starts = np.unique(inc_grp_key, return_index=True)
+        inc_ends = np.r_[inc_starts[1:], len(inc_grp_key)]
 
-            for _, irow in inc.iterrows():
-                its = irow["timestamp"]
-                while idx < n and chg.iloc[idx]["timestamp"] <= its:
-                    dq.append((chg.iloc[idx]["timestamp"], chg.iloc[idx]["title"]))
-                    idx += 1
-                cutoff = its - window
-                while dq and dq[0][0] < cutoff:
-                    dq.popleft()
+        # Prepare per-group slices up front, then run the GIL-free
+        # kernel across groups in parallel — groups are independent.
+        _, chg_idx, inc_idx = np.intersect1d(
+            chg_keys, inc_keys, assume_unique=True, return_indices=True
+        )
+        tasks = []
+        for ci, ii in zip(chg_idx, inc_idx):
+            chg_ts = chg_ts_all[chg_starts[ci] : chg_ends[ci]]
+            chg_codes = chg_codes_all[chg_starts[ci] : chg_ends[ci]]
+            inc_ts = inc_ts_all[inc_starts[ii] : inc_ends[ii]]
+            inc_codes = inc_codes_all[inc_starts[ii] : inc_ends[ii]]
+            tasks.append((chg_ts, chg_codes, inc_ts, inc_codes))
+
+        # Threads suffice while the nogil kernel dominates; processes
+        # sidestep the GIL entirely for very large inputs at the cost
+        # of shipping each group's arrays to a worker.
+        prefer = "processes" if use_processes else "threads"
+        outputs = Parallel(n_jobs=-1, prefer=prefer)(
+            delayed(_sweep)(
+                chg_ts, chg_codes, inc_ts, inc_codes, window_ns, n_chg_titles
+            )
+            for chg_ts, chg_codes, inc_ts, inc_codes in tasks
+        )
 
-                unique_titles = {t for _, t in dq}
-                for ctitle in unique_titles:
-                    results[(irow["title"], ctitle)] += 1
+        for pair_keys, counts in outputs:
+            for pair_key, count in zip(pair_keys, counts):
+                pair = (
+                    inc_cat.categories[pair_key // n_chg_titles],
+                    chg_cat.categories[pair_key % n_chg_titles],
+                )
+                results[pair] += int(count)
 
         return results
 
@@ -208,72 +823,17 @@ def save_raw_results(results):
     """Save raw results to a JSON file."""
     try:
         serializable = {
-            json.dumps(key, ensure_ascii=False): count for key, count in results.items()
+            f"{inc} ||| {chg}": count for (inc, chg), count in results.items()
         }
-        with open(COUNT_PAIRS_CACHE_FILE, "w", encoding="utf-8") as f:
-            json.dump(serializable, f, indent=2, ensure_ascii=False)
+        with open(COUNT_PAIRS_CACHE_FILE, "wb") as f:
+            f.write(orjson.dumps(serializable, option=orjson.OPT_INDENT_2))
     except Exception as e:
         print(f"Error saving raw results: {e}", file=sys.stderr)
         traceback.print_exc(file=sys.stderr)
         sys.exit(1)
 
 
-def filter_noise(changes, incidents, model):
-    """
-    Filters noise from changes and incidents using LLM classification."
-
-    Args:
-        changes: DataFrame of changes.
-        incidents: DataFrame of incidents.
-        model: Model name.
-
-    Returns:
-        Tuple of filtered changes and incidents.
-
-    1. Classify change titles as MEANINGFUL or NOISE.
-    2. Filter changes based on classification.
-    3. Classify incident titles as MEANINGFUL or NOISE.
-    4. Filter incidents based on classification.
-    5. Return filtered changes and incidents.
-    6. Handle exceptions and print error messages.
-    """
-    try:
-        # Separately classify change titles
-        change_titles = set(changes["title"])
-
-        change_prompt = (
-            "Classify the following CHANGE log title as MEANINGFUL or NOISE if the change can cause any incident:\n\n"
-            + "{item}\n\nReply with exactly MEANINGFUL or NOISE."
-        )
-        labeled_changes = classify_with_llm(
-            change_titles, change_prompt, CHANGE_NOISE_CACHE_FILE, model
-        )
-        valid_changes = {t for t, lbl in labeled_changes.items() if lbl == "MEANINGFUL"}
-        fchg = changes[changes["title"].isin(valid_changes)].copy()
-
-        # Separately classify incident titles
-        incident_titles = set(incidents["title"])
-        incident_prompt = (
-            "Classify the following INCIDENT log title as MEANINGFUL or NOISE based on meaning:\n\n"
-            + "{item}\n\nReply with exactly MEANINGFUL or NOISE."
-        )
-        labeled_incidents = classify_with_llm(
-            incident_titles, incident_prompt, INCIDENT_NOISE_CACHE_FILE, model
-        )
-        valid_incidents = {
-            t for t, lbl in labeled_incidents.items() if lbl == "MEANINGFUL"
-        }
-        finc = incidents[incidents["title"].isin(valid_incidents)].copy()
-
-        return fchg, finc
-
-    except Exception as e:
-        print(f"Error in noise filtering: {e}", file=sys.stderr)
-        traceback.print_exc(file=sys.stderr)
-        sys.exit(1)
-
-
-def filter_causality(raw_results, model):
+def filter_causality(raw_results, model, use_batch=False):
     """
     Filter causality using LLM classification.
 
@@ -284,24 +844,49 @@ def filter_causality(raw_results, model):
     Returns:
         Dictionary of filtered results.
 
-    1. Create a prompt for causality classification.
-    2. Classify pairs using the LLM.
-    3. Filter pairs based on classification.
-    4. Return filtered results.
-    5. Handle exceptions and print error messages.
+    1. Drop pairs whose titles match the curated noise regex.
+    2. Cluster incident titles into families of similar titles.
+    3. Reduce raw pairs to unique (family representative, change) pairs.
+    4. Classify the family-level pairs using the LLM.
+    5. Filter surviving pairs based on their family's classification.
+    6. Return filtered results.
+    7. Handle exceptions and print error messages.
 
     """
     try:
+        # Trivially-noisy titles never need a model verdict.
+        candidates = {
+            pair: cnt
+            for pair, cnt in raw_results.items()
+            if not (NOISE_RE.search(pair[0]) or NOISE_RE.search(pair[1]))
+        }
+
+        # The LLM only sees the two title strings, so near-identical
+        # incident titles get one verdict per family instead of one
+        # call per raw (incident, change) pair.
+        family_of = cluster_titles({inc for inc, _ in candidates})
+        family_pairs = sorted({(family_of[inc], chg) for inc, chg in candidates})
+
         prompt = (
-            "We have a system change: '{item[1]}' and an incident: '{item[0]}'.\n"
-            + "Reply with CAUSAL if the change likely caused the incident, otherwise NOT_CAUSAL."
+            "For each numbered pair in the next message, a system change is followed by an incident. "
+            + "Reply with a JSON array, one entry per pair: CAUSAL if the change likely caused the incident, otherwise NOT_CAUSAL. "
+            + "Also reply NOT_CAUSAL if either title is meaningless noise."
+        )
+        item_template = "change: '{item[1]}', incident: '{item[0]}'"
+        label_map = classify_with_llm(
+            family_pairs,
+            prompt,
+            item_template,
+            ("CAUSAL", "NOT_CAUSAL"),
+            CAUSALITY_NS,
+            model,
+            use_batch,
         )
-        label_map = classify_with_llm(raw_results, prompt, CAUSALITY_CACHE_FILE, model)
 
         final = {
-            pair: cnt
-            for pair, cnt in raw_results.items()
-            if label_map.get(pair) == "CAUSAL"
+            (inc, chg): cnt
+            for (inc, chg), cnt in candidates.items()
+            if label_map.get((family_of[inc], chg)) == "CAUSAL"
         }
         return final
 
@@ -315,8 +900,8 @@ def write_results(results, output_path):
     """Write results to a JSON file."""
     try:
         out = {f"{i} ||| {c}": cnt for (i, c), cnt in results.items()}
-        with open(output_path, "w") as f:
-            json.dump(out, f, indent=2)
+        with open(output_path, "wb") as f:
+            f.write(orjson.dumps(out, option=orjson.OPT_INDENT_2))
     except Exception as e:
         print(f"Error writing results: {e}", file=sys.stderr)
         traceback.print_exc(file=sys.stderr)
@@ -332,17 +917,18 @@ def main():
     # Load and prepare data
     changes, incidents = load_and_prepare(args.changes, args.incidents)
 
-    # Noise filtering
-    clean_changes, clean_incidents = filter_noise(changes, incidents, args.model)
-
-    # Raw correlation
-    raw = raw_correlate(clean_changes, clean_incidents, args.window_minutes)
+    # Raw correlation on unfiltered frames; the causality pass below
+    # also rejects pairs whose titles are noise, so a separate
+    # per-title noise pass is unnecessary.
+    raw = raw_correlate(
+        changes, incidents, args.window_minutes, args.use_processes
+    )
 
     # Save raw results
     save_raw_results(raw)
 
     # Causality filtering
-    causal = filter_causality(raw, args.model)
+    causal = filter_causality(raw, args.model, args.use_batch_api)
 
     # Output File
     write_results(causal, args.output)